@@ -0,0 +1,271 @@
+import collections
+import logging
+import re
+import threading
+import time
+
+from trello.trelloclient import TrelloClient
+
+from .data import ARCHIVES_ID, BOARD_ID, DashboardData
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_TEAM = 'da'
+
+# Seconds between refreshes of a single team's snapshot
+DEFAULT_REFRESH_INTERVAL = 300
+
+# Seconds before the shared member and label lookups for a board are fetched again
+DEFAULT_LOOKUP_MAX_AGE = 60 * 60
+
+# Team names are used as the first segment of the team's URLs
+TEAM_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+BoardConfig = collections.namedtuple('BoardConfig', ['team', 'board_id', 'archives_id'])
+
+
+def parse_board_configs(value, reserved_names=()):
+    """
+    Parses the board configuration string into a list of BoardConfig objects. The string is a
+    comma-separated list of entries in the form "team=board_id:archives_id". The first entry is
+    the default team, served at the root of the site. If the value is empty, the original
+    Developer Advocates board is used.
+
+    :param value: configuration string, typically read from the environment
+    :param reserved_names: names that can't be used as teams since they collide with existing
+        top-level URLs
+    :return: [BoardConfig]
+    """
+    if not value:
+        return [BoardConfig(DEFAULT_TEAM, BOARD_ID, ARCHIVES_ID)]
+
+    configs = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        try:
+            team, ids = entry.split('=', 1)
+            board_id, archives_id = ids.split(':', 1)
+        except ValueError:
+            raise ValueError('Invalid board configuration "%s", expected team=board_id:archives_id' % entry)
+
+        team, board_id, archives_id = team.strip(), board_id.strip(), archives_id.strip()
+        if not team or not board_id or not archives_id:
+            raise ValueError('Invalid board configuration "%s", team and both board IDs are required' % entry)
+        if not TEAM_NAME_PATTERN.match(team):
+            raise ValueError('Team name "%s" may only contain letters, digits, "-" and "_"' % team)
+        if team in reserved_names:
+            raise ValueError('Team name "%s" is reserved' % team)
+        if team in [c.team for c in configs]:
+            raise ValueError('Team "%s" is configured more than once' % team)
+
+        configs.append(BoardConfig(team, board_id, archives_id))
+
+    if not configs:
+        raise ValueError('No boards configured')
+
+    return configs
+
+
+class SharedLookups:
+    """
+    Board-level data that rarely changes (members and label definitions). These are fetched once
+    per board and reused by every snapshot built against that board, rather than being reloaded
+    on each refresh, unless a snapshot references a member or label they don't know. Members are merged into a single mapping since the same person is often on
+    several teams' boards.
+    """
+
+    def __init__(self, max_age=DEFAULT_LOOKUP_MAX_AGE):
+        self.max_age = max_age
+
+        self.members_by_id = {}  # {str: Member}
+        self.labels_by_board_id = {}  # {str: [Label]}
+
+        self._loaded_at = {}  # {str: float}
+        self._unresolved = {}  # {str: set}, ids still unknown after the board's last forced refresh
+        self._board_locks = {}  # {str: Lock}
+        self._lock = threading.Lock()
+
+    def load(self, board, force=False):
+        """
+        Ensures the members and labels for the given board are loaded, fetching them if they
+        have not been loaded yet or have expired.
+
+        :param board: trello board
+        :param force: if true, the lookups are fetched again regardless of their age
+        :return: [Label] defined on the board
+        """
+        with self._lock:
+            board_lock = self._board_locks.setdefault(board.id, threading.Lock())
+
+        # Fetches for one board don't hold up lookups for any other board
+        with board_lock:
+            with self._lock:
+                loaded_at = self._loaded_at.get(board.id)
+
+            if force or loaded_at is None or time.time() - loaded_at > self.max_age:
+                labels = board.get_labels()
+                members = board.all_members()
+
+                with self._lock:
+                    self.labels_by_board_id[board.id] = labels
+                    self.members_by_id.update({m.id: m for m in members})
+                    self._loaded_at[board.id] = time.time()
+                    self._unresolved.pop(board.id, None)
+
+            with self._lock:
+                return self.labels_by_board_id[board.id]
+
+    def ensure_known(self, board, member_ids, label_ids=()):
+        """
+        Forces a one-off refresh of the board's lookups if any of the given member or label IDs
+        are unknown, such as when someone was added to the board or a label was created since the
+        lookups were last fetched. IDs still unknown after that refresh (e.g. former members on
+        archived cards) don't force another refresh until the lookups next expire.
+
+        :param board: trello board
+        :param member_ids: IDs of the members referenced by the board's cards
+        :param label_ids: IDs of the labels referenced by the board's cards
+        """
+        ids = set(member_ids) | set(label_ids)
+
+        with self._lock:
+            missing = self._unknown(board, ids) - self._unresolved.get(board.id, set())
+        if not missing:
+            return
+
+        self.load(board, force=True)
+
+        with self._lock:
+            self._unresolved[board.id] = self._unknown(board, ids)
+
+    def _unknown(self, board, ids):
+        label_ids = {label.id for label in self.labels_by_board_id.get(board.id, [])}
+        return {i for i in ids if i not in self.members_by_id and i not in label_ids}
+
+
+class SnapshotCache:
+    """
+    Holds a loaded DashboardData snapshot per configured team. Once started, a single scheduler
+    thread refreshes each loaded snapshot at its own offset within the refresh interval, spreading
+    the teams evenly so the boards are not all polled at the same time. Requests are always served
+    the current snapshot; only a team's first load happens within a request. If a refresh fails,
+    the previous snapshot is kept and the team is tried again at its next slot.
+
+    If a card budget is given, the least recently used snapshots are dropped once the total
+    number of cards held across all snapshots exceeds it. Dropped snapshots are no longer
+    refreshed, and are loaded again on their next request.
+    """
+
+    def __init__(self, client: TrelloClient, boards, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 card_budget=None, lookups=None):
+        if refresh_interval <= 0:
+            raise ValueError('Refresh interval must be positive, got %s' % refresh_interval)
+        if card_budget is not None and card_budget < 0:
+            raise ValueError('Card budget may not be negative, got %s' % card_budget)
+
+        self.client = client
+        self.boards = collections.OrderedDict((b.team, b) for b in boards)
+        self.default_team = boards[0].team
+        self.refresh_interval = refresh_interval
+        self.card_budget = card_budget
+        self.lookups = lookups or SharedLookups()
+
+        self._offsets = {b.team: i * refresh_interval / len(boards) for i, b in enumerate(boards)}
+        self._snapshots = collections.OrderedDict()  # {str: DashboardData}, least recent first
+        self._team_locks = {team: threading.Lock() for team in self.boards}
+        self._lock = threading.Lock()
+        self._scheduler = None
+
+    def start(self):
+        """ Starts the background thread that refreshes the loaded snapshots. """
+        if self._scheduler is None:
+            self._scheduler = threading.Thread(target=self._run_scheduler, name='snapshot-refresh', daemon=True)
+            self._scheduler.start()
+
+    def get(self, team=None):
+        """
+        Returns the current snapshot for the given team, loading it if this is the first request
+        for the team (or its snapshot was dropped to stay within the card budget).
+
+        :param team: name of the team; if unspecified, the default team is used
+        :return: loaded DashboardData, or None if the team is not configured
+        """
+        team = team or self.default_team
+        if team not in self.boards:
+            return None
+
+        with self._lock:
+            dd = self._snapshots.get(team)
+            if dd is not None:
+                self._snapshots.move_to_end(team)
+
+        if dd is None:
+            # Only one load per team at a time; other teams are not blocked
+            with self._team_locks[team]:
+                # Another request may have finished the load while this one was waiting
+                with self._lock:
+                    dd = self._snapshots.get(team)
+                if dd is None:
+                    dd = self._load(team)
+
+        return dd
+
+    def _load(self, team):
+        board = self.boards[team]
+        dd = DashboardData(board.board_id, board.archives_id)
+        dd.load(self.client, self.lookups)
+
+        with self._lock:
+            # A refreshed snapshot keeps its place in the LRU order; a new one is the most recent
+            self._snapshots[team] = dd
+            self._enforce_budget(team)
+
+        return dd
+
+    def _next_refresh(self, after):
+        """ Returns the team with the earliest refresh slot strictly after the given time, and that slot. """
+        slots = []
+        for team, offset in self._offsets.items():
+            slot = offset + ((after - offset) // self.refresh_interval + 1) * self.refresh_interval
+            slots.append((slot, team))
+        slot, team = min(slots)
+        return team, slot
+
+    def _run_scheduler(self):
+        last_slot = time.time()
+        while True:
+            team, slot = self._next_refresh(last_slot)
+            time.sleep(max(0, slot - time.time()))
+            last_slot = slot
+
+            with self._team_locks[team]:
+                with self._lock:
+                    loaded = team in self._snapshots
+
+                # Teams that were never requested, or were dropped for the budget, load on demand
+                if not loaded:
+                    continue
+
+                try:
+                    self._load(team)
+                except Exception:
+                    LOG.exception('Failed to refresh the snapshot for team %s, keeping the previous one', team)
+
+    def _enforce_budget(self, keep_team):
+        if self.card_budget is None:
+            return
+
+        total = sum(dd.card_count() for dd in self._snapshots.values())
+        for team in list(self._snapshots):
+            if total <= self.card_budget:
+                break
+            if team == keep_team:
+                continue
+
+            dd = self._snapshots.pop(team)
+            total -= dd.card_count()
@@ -1,8 +1,12 @@
+import copy
 import datetime
+import logging
 
 from trello.trelloclient import TrelloClient
 
 
+LOG = logging.getLogger(__name__)
+
 BOARD_ID = '5f7f61eda018ce481185be8f'
 ARCHIVES_ID = '60e4b0e00879a001f87ff95c'
 
@@ -25,7 +29,9 @@ LABEL_LIVE_STREAM = 'Live Stream'
 
 class DashboardData:
 
-    def __init__(self):
+    def __init__(self, board_id=BOARD_ID, archives_id=ARCHIVES_ID):
+        self.board_id = board_id
+        self.archives_id = archives_id
 
         # Board Agnostic
         self.label_names = None  # [str]
@@ -41,7 +47,6 @@ class DashboardData:
         self.all_labels = None  # [Label]
         self.all_cards = None  # [Card]
         self.all_lists = None  # [TrelloList]
-        self.all_members = None  # [Member]
 
         self.list_names = None  # [str]
         self.lists_by_id = None  # {str: [List]}
@@ -65,26 +70,35 @@ class DashboardData:
 
         self.highlights_2021_list_ids = None  # [str]
 
-    def load(self, client: TrelloClient) -> None:
+    def load(self, client: TrelloClient, lookups) -> None:
         """
         Loads all of the necessary data from the Trello client, organizing it as necessary
         for future calls. No other calls should be made to objects of this class without having
         first called this method.
 
         :param client: authenticated trello client
+        :param lookups: SharedLookups holding the members and labels shared between snapshots
         """
 
         # Live network calls
-        self.board = client.get_board(BOARD_ID)
-        self.all_labels = self.board.get_labels()
+        self.board = client.get_board(self.board_id)
+        lookups.load(self.board)
         self.all_cards = self.board.open_cards()
         self.all_lists = self.board.open_lists()
-        self.all_members = self.board.all_members()
 
-        self.archives = client.get_board(ARCHIVES_ID)
+        # Pick up members and labels added to the board since the lookups were last fetched
+        lookups.ensure_known(self.board,
+                             [m_id for c in self.all_cards for m_id in (c.member_ids or [])],
+                             [label.id for c in self.all_cards for label in (c.labels or [])])
+        self.all_labels = lookups.load(self.board)
+
+        self.archives = client.get_board(self.archives_id)
+        lookups.load(self.archives)
         self.archive_lists = self.archives.open_lists()
         self.archive_cards = self.archives.open_cards()
 
+        lookups.ensure_known(self.archives, [m_id for c in self.archive_cards for m_id in (c.member_ids or [])])
+
         # Organize labels
         self.label_names = [label.name for label in self.all_labels]
 
@@ -94,7 +108,7 @@ class DashboardData:
         self.event_label_names = [LABEL_CUSTOMER, LABEL_CONFERENCE_WORKSHOP, LABEL_CONFERENCE_TALK]
 
         # Organize members
-        self.members_by_id = {m.id: m for m in self.all_members}
+        self.members_by_id = lookups.members_by_id
 
         # Organize lists
         self.list_names = [tlist.name for tlist in self.all_lists]
@@ -118,9 +132,10 @@ class DashboardData:
             else:
                 card.real_due_date = None
 
-            # Add in member names instead of IDs
+            # Add in member names instead of IDs, skipping anyone the board no longer lists
             if card.member_ids:
-                card.member_names = [self.members_by_id[m_id].full_name for m_id in card.member_ids]
+                card.member_names = [self.members_by_id[m_id].full_name for m_id in card.member_ids
+                                     if m_id in self.members_by_id]
 
                 for member in card.member_names:
                     mapping = member_cards.setdefault(member, [])
@@ -141,6 +156,10 @@ class DashboardData:
             # List cache
             list_cards.setdefault(card.list_id, []).append(card)
 
+        # Only the archive views use custom fields; they are pulled up once per snapshot so the
+        # views don't write to the shared cards
+        pull_up_custom_fields(self.archive_cards)
+
         for card in self.all_cards:
             _process_card(card, self.cards_by_member, self.cards_by_label, self.cards_by_list_id)
 
@@ -148,6 +167,10 @@ class DashboardData:
             _process_card(card, self.archive_cards_by_member, self.archive_cards_by_label,
                           self.archive_cards_by_list_id)
 
+    def card_count(self):
+        """ Returns the number of cards held in memory across both the live and archive boards. """
+        return len(self.all_cards or []) + len(self.archive_cards or [])
+
     def in_progress_cards(self):
         """
         Cards: All from 'In Progress' list
@@ -156,7 +179,7 @@ class DashboardData:
         """
         in_progress_id = self.lists_by_name[LIST_IN_PROGRESS].id
         in_progress_cards = self.cards_by_list_id[in_progress_id]
-        add_card_types(in_progress_cards, self.task_label_names)
+        in_progress_cards = add_card_types(in_progress_cards, self.task_label_names)
         sorted_cards = sorted(in_progress_cards, key=sort_cards_by_due)
         return sorted_cards
 
@@ -168,7 +191,7 @@ class DashboardData:
         """
         backlog_id = self.lists_by_name[LIST_BACKLOG].id
         backlog_cards = self.cards_by_list_id[backlog_id]
-        add_card_types(backlog_cards, self.task_label_names)
+        backlog_cards = add_card_types(backlog_cards, self.task_label_names)
         sorted_cards = sorted(backlog_cards, key=sort_cards_by_due)
         return sorted_cards
 
@@ -180,7 +203,7 @@ class DashboardData:
         """
         blocked_id = self.lists_by_name[LIST_BLOCKED].id
         blocked_cards = self.cards_by_list_id[blocked_id]
-        add_card_types(blocked_cards, self.task_label_names)
+        blocked_cards = add_card_types(blocked_cards, self.task_label_names)
         sorted_cards = sorted(blocked_cards, key=sort_cards_by_due)
         return sorted_cards
 
@@ -191,8 +214,8 @@ class DashboardData:
         Extra Fields: type
         """
 
-        # Everything in the scheduled events list
-        all_cards = self.cards_by_list_id[self.lists_by_name[LIST_EVENTS].id]
+        # Everything in the scheduled events list (copied, since the snapshot's list is reused across calls)
+        all_cards = list(self.cards_by_list_id[self.lists_by_name[LIST_EVENTS].id])
 
         # Event-related cards from the in progress list
         in_progress_cards = self.cards_by_list_id[self.lists_by_name[LIST_IN_PROGRESS].id]
@@ -205,7 +228,7 @@ class DashboardData:
                     all_cards.append(c)
                     break
 
-        add_card_types(all_cards, self.event_label_names)
+        all_cards = add_card_types(all_cards, self.event_label_names)
         sorted_cards = sorted(all_cards, key=sort_cards_by_due)
         return sorted_cards
 
@@ -219,7 +242,7 @@ class DashboardData:
 
         if done_id in self.cards_by_list_id:
             done_cards = self.cards_by_list_id[done_id]
-            add_card_types(done_cards, self.task_label_names)
+            done_cards = add_card_types(done_cards, self.task_label_names)
             cards = sorted(done_cards, key=sort_cards_by_due)
         else:
             cards = []
@@ -243,7 +266,7 @@ class DashboardData:
         upcoming_date = datetime.datetime.now() + datetime.timedelta(days=21)
         upcoming_cards = [c for c in all_soon_cards if c.real_due_date and c.real_due_date < upcoming_date]
 
-        add_card_types(upcoming_cards, self.task_label_names)
+        upcoming_cards = add_card_types(upcoming_cards, self.task_label_names)
         sorted_cards = sorted(upcoming_cards, key=sort_cards_by_due)
 
         return sorted_cards
@@ -284,7 +307,7 @@ class DashboardData:
             for card in card_list:
                 if card.list_id in [self.lists_by_name[LIST_IN_PROGRESS].id]:
                     filtered[member_name].append(card)
-            add_card_types(filtered[member_name], self.task_label_names)
+            filtered[member_name] = add_card_types(filtered[member_name], self.task_label_names)
             filtered[member_name].sort(key=sort_cards_by_due)
 
         return filtered
@@ -325,7 +348,7 @@ class DashboardData:
             for card in card_list:
                 if card.list_id in [self.lists_by_name[LIST_BACKLOG].id]:
                     filtered[member_name].append(card)
-            add_card_types(filtered[member_name], self.task_label_names)
+            filtered[member_name] = add_card_types(filtered[member_name], self.task_label_names)
             filtered[member_name].sort(key=sort_cards_by_due)
 
         return filtered
@@ -352,9 +375,8 @@ class DashboardData:
                                                  label_cards=self.archive_cards_by_label)
 
         # Add extra data for each card
-        for card_list in cards_by_label.values():
-            add_card_types(card_list, highlight_label_names)
-            pull_up_custom_fields(card_list)
+        for label, card_list in cards_by_label.items():
+            cards_by_label[label] = add_card_types(card_list, highlight_label_names)
 
         # Summarize monthly data
         stats = {
@@ -407,18 +429,10 @@ class DashboardData:
                 all_cards_for_month += cards
 
             # For each card, pull up the type information for simplicity
-            add_card_types(all_cards_for_month, labels)
+            all_cards_for_month = add_card_types(all_cards_for_month, labels)
 
-            # For each card, pull the attendees up to the top level for simplicity
+            # Increment the monthly count
             for c in all_cards_for_month:
-                # Figure out the event attendance
-                c.attendees = 0  # default in case we don't have these values
-                if len(c.custom_fields) > 0:
-                    for field in c.custom_fields:
-                        if field.name == 'Attendees':
-                            c.attendees = int(field.value)
-
-                # Increment the monthly count
                 month_data[month_name]['attendees'] += c.attendees
 
             # Store the results
@@ -464,15 +478,20 @@ def sort_cards_by_type(card):
 
 def add_card_types(card_list, accepted_labels):
     """
-    Adds a new field named "type" to each card in the given list. The type will be a list
-    of all label names in that card that appear in the list of provided acceptable labels.
-    If the card has no labels or none match, the type field will be an empty list.
+    Returns copies of the cards in the given list with a new field named "types". The types will
+    be a list of all label names in that card that appear in the list of provided acceptable labels.
+    If the card has no labels or none match, the types field will be an empty list. The original
+    cards are shared by every request against a snapshot, so they are left untouched.
     """
+    typed_cards = []
     for c in card_list:
         card_types = []
         if c.labels:
             card_types = [l.name for l in c.labels if l.name in accepted_labels]
-        c.types = card_types
+        typed_card = copy.copy(c)
+        typed_card.types = card_types
+        typed_cards.append(typed_card)
+    return typed_cards
 
 
 def pull_up_custom_fields(card_list):
@@ -481,12 +500,16 @@ def pull_up_custom_fields(card_list):
     """
     for c in card_list:
         # Establish defaults
-        c.attendees = None
+        c.attendees = 0
         c.content_url = None
 
         if len(c.custom_fields) > 0:
             for field in c.custom_fields:
                 if field.name == 'Attendees':
-                    c.attendees = int(field.value)
+                    # A bad value on one card shouldn't fail the load of the whole snapshot
+                    try:
+                        c.attendees = int(field.value)
+                    except (TypeError, ValueError):
+                        LOG.warning('Ignoring invalid attendees value "%s" on card %s', field.value, c.id)
                 elif field.name == 'URL':
                     c.content_url = field.value
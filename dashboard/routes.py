@@ -1,9 +1,10 @@
 import os
 
 from flask import current_app as app
-from flask import render_template, request
+from flask import abort, g, render_template, request
 from trello import TrelloClient
 
+from .boards import DEFAULT_REFRESH_INTERVAL, SnapshotCache, parse_board_configs
 from .data import DashboardData
 
 
@@ -11,122 +12,148 @@ ENV_API_KEY = 'API_KEY'
 ENV_API_SECRET = 'API_SECRET'
 ENV_TOKEN = 'TOKEN'
 
+# Comma-separated "team=board_id:archives_id" entries; the first team is also served at /
+ENV_BOARDS = 'BOARDS'
+
+# Seconds between refreshes of each team's snapshot
+ENV_REFRESH_INTERVAL = 'REFRESH_INTERVAL'
+
+# Maximum number of cards held in memory across all snapshots; unlimited if unset
+ENV_CARD_BUDGET = 'CARD_BUDGET'
+
 
 @app.route('/', methods=('GET',))
-def in_progress():
-    dd = _load_data()
+@app.route('/<team>/', methods=('GET',))
+def in_progress(team=None):
+    dd = _load_data(team)
     in_progress_cards = dd.in_progress_cards()
     return render_template('in_progress.html', cards=in_progress_cards, title='In Progress Tasks')
 
 
 @app.route('/done', methods=('GET',))
-def done():
-    dd = _load_data()
+@app.route('/<team>/done', methods=('GET',))
+def done(team=None):
+    dd = _load_data(team)
     done_cards = dd.done_cards()
     return render_template('done.html', cards=done_cards, title='Completed Cards')
 
 
 @app.route('/soon', methods=('GET',))
-def soon():
-    dd = _load_data()
+@app.route('/<team>/soon', methods=('GET',))
+def soon(team=None):
+    dd = _load_data(team)
     soon_cards = dd.coming_soon_cards()
     return render_template('soon.html', cards=soon_cards, title='Cards Due Soon')
 
 
 @app.route('/blocked', methods=('GET',))
-def blocked():
-    dd = _load_data()
+@app.route('/<team>/blocked', methods=('GET',))
+def blocked(team=None):
+    dd = _load_data(team)
     blocked_cards = dd.blocked_cards()
     return render_template('in_progress.html', cards=blocked_cards, title='Blocked or Waiting Cards')
 
 
 @app.route('/in-progress-activity', methods=('GET', ))
-def in_progress_activity():
-    dd = _load_data()
+@app.route('/<team>/in-progress-activity', methods=('GET', ))
+def in_progress_activity(team=None):
+    dd = _load_data(team)
     cards_by_label = dd.in_progress_activities()
     return render_template('activity.html', cards=cards_by_label, title='In Progress by Activity')
 
 
 @app.route('/in-progress-products', methods=('GET', ))
-def in_progress_products():
-    dd = _load_data()
+@app.route('/<team>/in-progress-products', methods=('GET', ))
+def in_progress_products(team=None):
+    dd = _load_data(team)
     cards_by_label = dd.in_progress_products()
     return render_template('products.html', cards=cards_by_label, title='In Progress by Product')
 
 
 @app.route('/in-progress-epics', methods=('GET',))
-def in_progress_epics():
-    dd = _load_data()
+@app.route('/<team>/in-progress-epics', methods=('GET',))
+def in_progress_epics(team=None):
+    dd = _load_data(team)
     cards_by_epic = dd.in_progress_epics()
     return render_template('epics.html', cards=cards_by_epic, title='In Progress by Epic')
 
 
 @app.route('/in-progress-team', methods=('GET', ))
-def in_progress_team():
-    dd = _load_data()
+@app.route('/<team>/in-progress-team', methods=('GET', ))
+def in_progress_team(team=None):
+    dd = _load_data(team)
     cards_by_member = dd.in_progress_team()
     return render_template('team.html', cards=cards_by_member, title='In Progress by Team Member')
 
 
 @app.route('/backlog', methods=('GET',))
-def backlog():
-    dd = _load_data()
+@app.route('/<team>/backlog', methods=('GET',))
+def backlog(team=None):
+    dd = _load_data(team)
     backlog_cards = dd.backlog_cards()
     return render_template('in_progress.html', cards=backlog_cards, title='Tasks Backlog')
 
 
 @app.route('/backlog-activity', methods=('GET', ))
-def backlog_activity():
-    dd = _load_data()
+@app.route('/<team>/backlog-activity', methods=('GET', ))
+def backlog_activity(team=None):
+    dd = _load_data(team)
     cards_by_label = dd.backlog_activities()
     return render_template('activity.html', cards=cards_by_label, title='Tasks Backlog by Activity')
 
 
 @app.route('/backlog-products', methods=('GET', ))
-def backlog_products():
-    dd = _load_data()
+@app.route('/<team>/backlog-products', methods=('GET', ))
+def backlog_products(team=None):
+    dd = _load_data(team)
     cards_by_label = dd.backlog_products()
     return render_template('products.html', cards=cards_by_label, title='Tasks Backlog by Product')
 
 
 @app.route('/backlog-epics', methods=('GET',))
-def backlog_epics():
-    dd = _load_data()
+@app.route('/<team>/backlog-epics', methods=('GET',))
+def backlog_epics(team=None):
+    dd = _load_data(team)
     cards_by_epic = dd.backlog_epics()
     return render_template('epics.html', cards=cards_by_epic, title='Tasks Backlog by Epic')
 
 
 @app.route('/backlog-team', methods=('GET', ))
-def backlog_team():
-    dd = _load_data()
+@app.route('/<team>/backlog-team', methods=('GET', ))
+def backlog_team(team=None):
+    dd = _load_data(team)
     cards_by_member = dd.backlog_team()
     return render_template('team.html', cards=cards_by_member, title='Tasks Backlog by Team Member')
 
 
 @app.route('/upcoming-events', methods=('GET', ))
-def upcoming_events():
-    dd = _load_data()
+@app.route('/<team>/upcoming-events', methods=('GET', ))
+def upcoming_events(team=None):
+    dd = _load_data(team)
     cards = dd.upcoming_events_cards()
     return render_template('events.html', cards=cards, title='Scheduled Events')
 
 
 @app.route('/all-attendees', methods=('GET', ))
-def attendees():
-    dd = _load_data()
+@app.route('/<team>/all-attendees', methods=('GET', ))
+def attendees(team=None):
+    dd = _load_data(team)
     month_cards, month_data = dd.all_attendees()
     return render_template('attendees.html', cards=month_cards, data=month_data, title='Past Event Attendance')
 
 
 @app.route('/customer-engagements', methods=('GET', ))
-def customer_engagements():
-    dd = _load_data()
+@app.route('/<team>/customer-engagements', methods=('GET', ))
+def customer_engagements(team=None):
+    dd = _load_data(team)
     month_cards, month_data = dd.customer_attendees()
     return render_template('attendees.html', cards=month_cards, data=month_data, title='Past Customer Engagement Attendance')
 
 
 @app.route('/month', methods=('GET',))
-def month():
-    dd = _load_data()
+@app.route('/<team>/month', methods=('GET',))
+def month(team=None):
+    dd = _load_data(team)
 
     month_list_id = request.args.get('month', None)
     if month_list_id:
@@ -140,14 +167,46 @@ def month():
         return render_template('month_list.html', months=month_list, title='Monthly Highlights')
 
 
-def _load_data() -> DashboardData:
+@app.context_processor
+def team_context():
+    team = g.get('team')
+    return {
+        'team_prefix': '/' + team if team else '',
+        'board_url': g.get('board_url'),
+    }
+
+
+def _create_snapshots() -> SnapshotCache:
     # Load Trello credentials from environment and create client
     api_key = os.environ.get(ENV_API_KEY)
     api_secret = os.environ.get(ENV_API_SECRET)
     token = os.environ.get(ENV_TOKEN)
 
     client = TrelloClient(api_key=api_key, api_secret=api_secret, token=token)
-    dd = DashboardData()
-    dd.load(client)
+
+    # Teams can't share a name with any existing top-level URL (e.g. /done, /static)
+    reserved_names = {rule.rule.split('/')[1] for rule in app.url_map.iter_rules()
+                      if not rule.rule.startswith('/<')}
+
+    boards = parse_board_configs(os.environ.get(ENV_BOARDS), reserved_names=reserved_names)
+    refresh_interval = int(os.environ.get(ENV_REFRESH_INTERVAL, DEFAULT_REFRESH_INTERVAL))
+    card_budget = os.environ.get(ENV_CARD_BUDGET)
+    card_budget = int(card_budget) if card_budget else None
+
+    return SnapshotCache(client, boards, refresh_interval=refresh_interval, card_budget=card_budget)
+
+
+snapshots = _create_snapshots()
+snapshots.start()
+
+
+def _load_data(team=None) -> DashboardData:
+    dd = snapshots.get(team)
+    if dd is None:
+        abort(404)
+
+    # Links in the templates stay under the team prefix used in the request
+    g.team = team
+    g.board_url = dd.board.url
 
     return dd